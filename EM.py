@@ -134,23 +134,19 @@ class EM:
         y = np.argmax(self.predict(point), axis=1)  # predict label
 
         accuracy = np.sum(y == t) / len(label)
-        precision = []
-        recall = []
-        for k in range(self.K):     # find the precision of each cluster
-            TP = 0  # Predict class == k, Actual class == k
-            FP = 0  # Predict class == k, Actual class != k
-            TN = 0  # Predict class != k, Actual class != k
-            FN = 0  # Predict class != k, Actual class == k
-            for n in range(len(point)):
-                if y[n] == k and t[n] == k: TP += 1
-                if y[n] == k and t[n] != k: FP += 1
-                if y[n] != k and t[n] != k: TN += 1
-                if y[n] != k and t[n] == k: FN += 1
-
-            if TP + FP == 0: precision.append(0)  # avoid divide zero
-            else: precision.append(TP / (TP + FP))
-
-            if TP + FN == 0: recall.append(0)  # avoid divide zero
-            else: recall.append(TP / (TP + FN))
-
-        return [accuracy, precision, recall]
+
+        # count every (actual, predict) pair at once instead of scanning the
+        # sample N*K times in Python
+        cm = np.zeros((self.K, self.K), dtype=np.int64)  # confusion matrix
+        np.add.at(cm, (t, y), 1)
+        TP = np.diag(cm)            # Predict class == k, Actual class == k
+        FP = cm.sum(axis=0) - TP    # Predict class == k, Actual class != k
+        FN = cm.sum(axis=1) - TP    # Predict class != k, Actual class == k
+
+        # "where" avoids divide zero, leaving 0 for empty classes
+        precision = np.divide(TP, TP + FP,
+                              out=np.zeros(self.K), where=(TP + FP) != 0)
+        recall = np.divide(TP, TP + FN,
+                           out=np.zeros(self.K), where=(TP + FN) != 0)
+
+        return [accuracy, list(precision), list(recall)]
@@ -98,12 +98,14 @@ class Gaussian:
         if index is None: index = [0.5, 0.7]
         n_1 = int(index[0] * self.N)
         n_2 = int(index[1] * self.N)
-        self.train_point = np.array([self.point[i] for i in range(n_1)])
-        self.train_label = np.array([self.label[i] for i in range(n_1)])
-        self.valid_point = np.array([self.point[i] for i in range(n_1, n_2)])
-        self.valid_label = np.array([self.label[i] for i in range(n_1, n_2)])
-        self.test_point = np.array([self.point[i] for i in range(n_2, self.N)])
-        self.test_label = np.array([self.label[i] for i in range(n_2, self.N)])
+        # constant-time views of "point"/"label" instead of rebuilding each
+        # split through a Python list of rows
+        self.train_point = self.point[:n_1]
+        self.train_label = self.label[:n_1]
+        self.valid_point = self.point[n_1:n_2]
+        self.valid_label = self.label[n_1:n_2]
+        self.test_point = self.point[n_2:]
+        self.test_label = self.label[n_2:]
 
     def plot_sample(self, sample="valid"):
         plt.rcParams["figure.dpi"] = 200
@@ -1,9 +1,11 @@
 import time
 import numpy as np
+from scipy.special import expit
 
 
 class NN:
-    def __init__(self, dimension, neuron_num, activation_func, NN_type="QNN"):
+    def __init__(self, dimension, neuron_num, activation_func, NN_type="QNN",
+                 seed=None):
         """
         :param dimension: dimension of sample point, int
         :param neuron_num: dictionary, { layer index : number of nodes }
@@ -12,8 +14,10 @@ class NN:
             the activation function after each layers' output, including hidden
             and output layers
         :param NN_type: which type of neural network: "QNN" or "CNN"
+        :param seed: optional seed for the weight initialization
         """
         self.NN_type = NN_type
+        self.seed = seed
 
         # basic dimension parameter
         self.L = len(neuron_num)  # number of hidden & output layer
@@ -23,7 +27,19 @@ class NN:
         # network parameter
         self.neuron_num = neuron_num
         self.activation_func = activation_func
-        self.para = {}  # weight and bias
+        # integer tag per layer (0 relu, 1 sigmoid, 2 softmax) so the hot
+        # loops branch on a plain int compare instead of method equality
+        self._act_code = [
+            2 if activation_func[l] == self.softmax else
+            0 if activation_func[l] == self.relu else 1
+            for l in range(self.L)
+        ]
+        # plain list of the callables so the forward loops index a list
+        # instead of hashing into the dictionary every layer
+        self._act_fn = [activation_func[l] for l in range(self.L)]
+        self.para = {}  # weight and bias, views into one flat buffer
+        self.para_T = {}  # contiguous 'wb' transposes for the QNN backward
+        self.grad = {}  # gradient of each parameter, views like "para"
 
         # optimizer parameter
         self.h = {}  # for optimizer "AdaGrad", "RMSprop"
@@ -37,23 +53,26 @@ class NN:
             "iter": 0  # int, for optimizer "Adam"
         }
 
+        # per-layer activation buffers reused across gradient steps, sized
+        # for the current batch on first use
+        self._fwd_buf = None
+        self._fwd_buf_N = 0
+        self._qnn_buf = None
+        self._qnn_buf_N = 0
+        self._w_rg_T = []  # contiguous transpose of each packed w_rg block
+
         self.initialize()  # initialize para, h, m, v
 
         # result
         self.train_time = 0
         self.valid_loss = []
 
-    def _initialize_CNN(self):
+    def _shape_CNN(self):
         """
-        Initialize parameters for CNN
-
-        See https://proceedings.mlr.press/v9/glorot10a/glorot10a.pdf (English)
-            https://arxiv.org/abs/1502.01852 (English)
-        about the initialization of parameter weighs and bias.
+        Shape of every CNN parameter, keyed like "para", in a fixed order so
+        each tensor gets a stable slice of the flat buffers.
         """
-        if len(self.activation_func) != self.L:
-            print('Error! Dimension of the "activation_func" not match!')
-
+        shape = {}
         for l in range(self.L):
             if l == 0:
                 node_from = self.D
@@ -61,31 +80,37 @@ class NN:
                 node_from = self.neuron_num[l - 1]
             node_to = self.neuron_num[l]
 
-            # sd for initialize weight 'w', parameter of network
-            sd = 0.01
-            """ # He initialization
-            if self.activation_func[l] == self.sigmoid:
-                sd = np.sqrt(1 / node_from)
-            elif self.activation_func[l] == self.relu:
-                sd = np.sqrt(2 / node_from)
-            """
+            shape['w' + str(l)] = (node_from, node_to)
+            shape['b' + str(l)] = (1, node_to)
+        return shape
 
-            # initialize parameters
-            key = 'w' + str(l)
-            self.para[key] = sd * np.random.randn(node_from, node_to)
-            self.h[key] = np.zeros((node_from, node_to))
-            self.m[key] = np.zeros((node_from, node_to))
-            self.v[key] = np.zeros((node_from, node_to))
+    def _shape_QNN(self):
+        """
+        Shape of every QNN parameter, keyed like "para", in a fixed order so
+        each tensor gets a stable slice of the flat buffers.
+        """
+        shape = {}
+        for l in range(self.L):
+            if l == 0:
+                node_from = self.D
+            else:
+                node_from = self.neuron_num[l - 1]
+            node_to = self.neuron_num[l]
 
-            key = 'b' + str(l)
-            self.para[key] = np.zeros((1, node_to))
-            self.h[key] = np.zeros((1, node_to))
-            self.m[key] = np.zeros((1, node_to))
-            self.v[key] = np.zeros((1, node_to))
+            for j in ('r', 'g', 'b'):
+                shape['w' + j + str(l)] = (node_from, node_to)
+                shape['b' + j + str(l)] = (1, node_to)
+        return shape
 
-    def _initialize_QNN(self):
+    def initialize(self):
         """
-        Initialize parameters for QNN
+        Initialize parameters, gradient, and optimizer state.
+
+        Each role ("para", "grad", "h", "m", "v") lives in one contiguous
+        flat float32 buffer; the per-key dictionaries only hold reshaped
+        views into it. The forward/backward passes keep addressing tensors
+        by name while the optimizers update the whole flat vector in a
+        single pass instead of one small kernel per key.
 
         See https://proceedings.mlr.press/v9/glorot10a/glorot10a.pdf (English)
             https://arxiv.org/abs/1502.01852 (English)
@@ -94,72 +119,220 @@ class NN:
         if len(self.activation_func) != self.L:
             print('Error! Dimension of the "activation_func" not match!')
 
+        if self.NN_type == "CNN": shape = self._shape_CNN()
+        else: shape = self._shape_QNN()
+
+        # flat buffer of each role
+        # float32 is plenty for a small classifier and halves the bytes
+        # moved by every GEMM and optimizer update
+        total = sum(int(np.prod(s)) for s in shape.values())
+        self._para_flat = np.empty(total, dtype=np.float32)
+        self._grad_flat = np.zeros(total, dtype=np.float32)
+        self._h_flat = np.zeros(total, dtype=np.float32)
+        self._m_flat = np.zeros(total, dtype=np.float32)
+        self._v_flat = np.zeros(total, dtype=np.float32)
+        self._scratch_flat = np.empty(total, dtype=np.float32)
+
+        # per-key views into the flat buffers
+        roles = (
+            (self._para_flat, self.para), (self._grad_flat, self.grad),
+            (self._h_flat, self.h), (self._m_flat, self.m),
+            (self._v_flat, self.v),
+        )
+        if self.NN_type == "QNN":
+            # pack each layer's r and g weights (and biases) side by side in
+            # one (node_from, 2 * node_to) block: "wr"/"wg" stay addressable
+            # as column views while the forward multiplies both against the
+            # same "a" in a single GEMM instead of two
+            self._w_rg, self._b_rg = [], []      # para blocks, per layer
+            self._gw_rg, self._gb_rg = [], []    # grad blocks, per layer
+            offset = 0
+            for l in range(self.L):
+                node_from, node_to = shape['wr' + str(l)]
+                for dim, tag in ((node_from, 'w'), (1, 'b')):
+                    n = 2 * dim * node_to
+                    for flat, dic in roles:
+                        block = flat[offset:offset + n] \
+                            .reshape(dim, 2 * node_to)
+                        dic[tag + 'r' + str(l)] = block[:, :node_to]
+                        dic[tag + 'g' + str(l)] = block[:, node_to:]
+                        if dic is self.para:
+                            (self._w_rg if tag == 'w'
+                             else self._b_rg).append(block)
+                        if dic is self.grad:
+                            (self._gw_rg if tag == 'w'
+                             else self._gb_rg).append(block)
+                    offset += n
+                for key in ('wb' + str(l), 'bb' + str(l)):
+                    s = shape[key]
+                    n = int(np.prod(s))
+                    for flat, dic in roles:
+                        dic[key] = flat[offset:offset + n].reshape(s)
+                    offset += n
+        else:
+            offset = 0
+            for key, s in shape.items():
+                n = int(np.prod(s))
+                for flat, dic in roles:
+                    dic[key] = flat[offset:offset + n].reshape(s)
+                offset += n
+
+        # sd for initialize weight 'w', parameter of network
+        sd = 0.01
+        """ # He initialization
+        if self.activation_func[l] == self.sigmoid:
+            sd = np.sqrt(1 / node_from)
+        elif self.activation_func[l] == self.relu:
+            sd = np.sqrt(2 / node_from)
+        """
+
+        # one PCG64 draw covers every weight tensor: faster than the legacy
+        # global MT19937 and natively float32, so no downcast afterwards
+        w_keys = [key for key in self.para if key[0] == 'w']
+        rng = np.random.default_rng(self.seed)
+        pool = rng.standard_normal(
+            sum(int(np.prod(shape[key])) for key in w_keys), dtype=np.float32)
+        pool *= sd
+
+        offset = 0
+        for key in w_keys:
+            n = int(np.prod(shape[key]))
+            self.para[key][...] = pool[offset:offset + n].reshape(shape[key])
+            offset += n
+        for key in self.para:
+            if key[0] != 'w': self.para[key][...] = 0
+
+        self._refresh_para_T()
+
+        # direct per-layer array references so the hot loops neither build
+        # key strings like 'wr' + str(l) nor hash into the dictionaries;
+        # the referenced arrays are stable since "_refresh_para_T" and
+        # "load" only copy into them
+        if self.NN_type == "QNN":
+            self._wb = [self.para['wb' + str(l)] for l in range(self.L)]
+            self._bb = [self.para['bb' + str(l)] for l in range(self.L)]
+            self._gw = [(self.grad['wr' + str(l)], self.grad['wg' + str(l)],
+                         self.grad['wb' + str(l)]) for l in range(self.L)]
+            self._gb = [(self.grad['br' + str(l)], self.grad['bg' + str(l)],
+                         self.grad['bb' + str(l)]) for l in range(self.L)]
+            self._wbT = [self.para_T['wb' + str(l)] for l in range(self.L)]
+        else:
+            self._w = [self.para['w' + str(l)] for l in range(self.L)]
+            self._b = [self.para['b' + str(l)] for l in range(self.L)]
+            self._gw = [self.grad['w' + str(l)] for l in range(self.L)]
+            self._gb = [self.grad['b' + str(l)] for l in range(self.L)]
+
+    def _refresh_para_T(self):
+        """
+        Keep the cached weight transposes in sync with the weights so the
+        QNN backward can read already-contiguous transposes instead of
+        building them (and the copy BLAS makes of strided views) every
+        step. The copy happens here, in the optimizer step that was
+        touching the weights anyway. Only the transposes the backward
+        actually reads are maintained: "wb" per layer plus the packed
+        "w_rg" blocks; the CNN backward hands ".T" views straight to BLAS
+        and keeps no cache, so a CNN model skips the refresh entirely.
+        """
+        if self.NN_type != "QNN": return
+
         for l in range(self.L):
-            if l == 0:
-                node_from = self.D
+            key = 'wb' + str(l)
+            if key in self.para_T:
+                np.copyto(self.para_T[key], self.para[key].T)
             else:
-                node_from = self.neuron_num[l - 1]
-            node_to = self.neuron_num[l]
+                self.para_T[key] = np.ascontiguousarray(self.para[key].T)
 
-            # sd for initialize weight 'w', parameter of network
-            sd = 0.01
-            """ # He initialization
-            if self.activation_func[l] == self.sigmoid:
-                sd = np.sqrt(1 / node_from)
-            elif self.activation_func[l] == self.relu:
-                sd = np.sqrt(2 / node_from)
-            """
+        # transpose of each packed "w_rg" block: the backward recovers
+        # dar + dag with one GEMM against the matching packed "dz_rg"
+        if self._w_rg_T:
+            for dst, block in zip(self._w_rg_T, self._w_rg):
+                np.copyto(dst, block.T)
+        else:
+            self._w_rg_T = [np.ascontiguousarray(block.T)
+                            for block in self._w_rg]
 
-            # initialize parameters
-            for j in ('r', 'g', 'b'):
-                key = 'w' + j + str(l)
-                self.para[key] = sd * np.random.randn(node_from, node_to)
-                self.h[key] = np.zeros((node_from, node_to))
-                self.m[key] = np.zeros((node_from, node_to))
-                self.v[key] = np.zeros((node_from, node_to))
-
-                key = 'b' + j + str(l)
-                self.para[key] = np.zeros((1, node_to))
-                self.h[key] = np.zeros((1, node_to))
-                self.m[key] = np.zeros((1, node_to))
-                self.v[key] = np.zeros((1, node_to))
+    def load(self, para, h, m, v):
+        # copy into the views so "para" etc. stay backed by the flat buffers
+        for key in self.para:
+            self.para[key][...] = para[key]
+            self.h[key][...] = h[key]
+            self.m[key][...] = m[key]
+            self.v[key][...] = v[key]
+        self._refresh_para_T()
+
+    def save(self, path):
+        """
+        Save "para", "h", "m", "v" into one binary ".npz" file. One file
+        open and no float-to-ASCII conversion, so it is much faster than
+        one text file per tensor.
 
-    def initialize(self):
-        if self.NN_type == "CNN": return self._initialize_CNN()
-        if self.NN_type == "QNN": return self._initialize_QNN()
+        :param path: file to write, np.savez appends ".npz" if missing
+        """
+        data = {}
+        for prefix, dic in (('para_', self.para), ('h_', self.h),
+                            ('m_', self.m), ('v_', self.v)):
+            for key in dic: data[prefix + key] = dic[key]
+        np.savez_compressed(path, **data)
 
-    def load(self, para, h, m, v):
-        self.para, self.h, self.m, self.v = para, h, m, v
+    def load_file(self, path):
+        """
+        Load the parameters and optimizer state written by "save".
+
+        :param path: ".npz" file written by "save"
+        """
+        with np.load(path) as data:  # close the lazy NpzFile's handle
+            for prefix, dic in (('para_', self.para), ('h_', self.h),
+                                ('m_', self.m), ('v_', self.v)):
+                for key in dic: dic[key][...] = data[prefix + key]
+        self._refresh_para_T()
 
     """ Activation Functions """
 
     @staticmethod
     def relu(x):
-        return np.maximum(0, x)
+        # in-place: every caller passes a freshly computed "z" buffer, so
+        # clipping it directly saves an allocation per layer per pass
+        return np.maximum(x, 0, out=x)
 
     @staticmethod
     def sigmoid(x):
-        return 1 / (1 + np.exp(-x))
+        # one fused, numerically stable C kernel: no overflow for large
+        # negative x and no Python-level temporaries
+        return expit(x)
 
     @staticmethod
     def softmax(x):
-        if x.ndim == 2:
-            x = x.T
-            x -= np.max(x, axis=0)
-            y = np.exp(x) / np.sum(np.exp(x), axis=0)
-            return y.T
-
-        x -= np.max(x)
-        return np.exp(x) / np.sum(np.exp(x))
+        # "x - max" makes a private copy, so exp and the normalization can
+        # run in-place on it; axis=-1 covers the 1D and 2D case without the
+        # transpose trick
+        x = x - np.max(x, axis=-1, keepdims=True)
+        np.exp(x, out=x)
+        x /= np.sum(x, axis=-1, keepdims=True)
+        return x
 
     """ Trainer """
 
+    def _get_fwd_buf(self, N):
+        """
+        One reusable (N, neuron_num[l]) buffer per layer for the gradient
+        forward pass. Training calls the gradient with the same batch
+        thousands of times; without this every step reallocates every
+        intermediate.
+        """
+        if self._fwd_buf is None or self._fwd_buf_N != N:
+            self._fwd_buf = [
+                np.empty((N, self.neuron_num[l]), dtype=np.float32)
+                for l in range(self.L)
+            ]
+            self._fwd_buf_N = N
+        return self._fwd_buf
+
     def _gradient_CNN(self, point, label):
         """
         "Backpropagation"
 
         Use backpropagation to find every parameters' gradient with less time
-        complexity than Numerical Gradient "gradient_ng".
+        complexity than a numerical finite-difference gradient.
 
         We first take forward step, which same to "predict", the only different
         is we record the "a" value using a dictionary since we need to use it
@@ -178,85 +351,144 @@ class NN:
 
         :param point: [ sample_size * D ], np.array
         :param label: [ sample_size * K ], np.array
-        :return: dictionary, gradient for all the parameter
+        :return: dictionary, gradient for all the parameter; the values are
+            the "grad" views, so the result also lands in the flat gradient
+            buffer the optimizers consume
         """
-        grad = {}
+        grad = self.grad
+        buf = self._get_fwd_buf(point.shape[0])
 
         # forward
         # a0 -> w0,b0 -> z0 -> a1 -> w1,b1 -> z1 -> a2
+        # np.dot(out=) writes each pre-activation straight into its reused
+        # buffer, so the forward allocates nothing after the first step
         a = {0: point}
         for l in range(self.L):
-            z = np.dot(a[l], self.para['w' + str(l)]) + self.para['b' + str(l)]
-            a[l + 1] = self.activation_func[l](z)
+            z = buf[l]
+            np.dot(a[l], self._w[l], out=z)
+            z += self._b[l]
+            a[l + 1] = self._act_fn[l](z)
 
         # backward
         # da0 <- dw0,db0 <- dz0 <- da1 <- dw1,db1 <- dz1 <- da2
         da = 0
         for l in range(self.L - 1, -1, -1):
-            if self.activation_func[l] == self.softmax:  # softmax with loss
+            code = self._act_code[l]
+            if code == 2:    # softmax with loss
                 dz = a[l + 1] - label
-            elif self.activation_func[l] == self.relu:  # relu
+            elif code == 0:  # relu
                 dz = da * (a[l + 1] != 0)
-            else:  # sigmoid
+            else:            # sigmoid
                 dz = da * (1.0 - a[l + 1]) * a[l + 1]
 
-            grad['w' + str(l)] = np.dot(a[l].T, dz)  # dw
-            grad['b' + str(l)] = np.sum(dz, axis=0)  # db
-            da = np.dot(dz, self.para['w' + str(l)].T)
+            # ".T" is a free stride swap that np.dot forwards to BLAS as a
+            # transpose flag, so no transposed copy is materialized per layer
+            np.dot(a[l].T, dz, out=self._gw[l])  # dw
+            self._gb[l][...] = np.sum(dz, axis=0)  # db
+            da = np.dot(dz, self._w[l].T)
 
         return grad
 
+    def _get_qnn_buf(self, N):
+        """
+        Reusable per-layer buffers for the QNN gradient intermediates, the
+        counterpart of "_get_fwd_buf" for the CNN: training hits this path
+        with the same batch thousands of times, so every intermediate is
+        written into preallocated storage instead of a fresh allocation.
+        """
+        if self._qnn_buf is None or self._qnn_buf_N != N:
+            self._qnn_buf = []
+            for l in range(self.L):
+                node_from = self.D if l == 0 else self.neuron_num[l - 1]
+                node_to = self.neuron_num[l]
+                self._qnn_buf.append({
+                    'z_rg': np.empty((N, 2 * node_to), dtype=np.float32),
+                    'a2': np.empty((N, node_from), dtype=np.float32),
+                    'zb': np.empty((N, node_to), dtype=np.float32),
+                    'z': np.empty((N, node_to), dtype=np.float32),
+                    'dz_rg': np.empty((N, 2 * node_to), dtype=np.float32),
+                })
+            self._qnn_buf_N = N
+        return self._qnn_buf
+
     def _gradient_QNN(self, point, label):
-        grad = {}
+        grad = self.grad
+        buf = self._get_qnn_buf(point.shape[0])
 
         # forward
         a = {0: point}
+        a2 = {}  # a[l] ** 2, kept for the backward pass
         zr = {}
         zg = {}
         for l in range(self.L):
-            zr[l] = np.dot(a[l], self.para['wr' + str(l)]) + \
-                    self.para['br' + str(l)]
-            zg[l] = np.dot(a[l], self.para['wg' + str(l)]) + \
-                    self.para['bg' + str(l)]
-            zb = np.dot(a[l] ** 2, self.para['wb' + str(l)]) + \
-                 self.para['bb' + str(l)]
-            z = np.multiply(zr[l], zg[l]) + zb
-            a[l + 1] = self.activation_func[l](z)
+            b = buf[l]
+            # one GEMM covers the r and g branches, see "initialize"
+            np.dot(a[l], self._w_rg[l], out=b['z_rg'])
+            b['z_rg'] += self._b_rg[l]
+            zr[l], zg[l] = np.split(b['z_rg'], 2, axis=1)
+            a2[l] = np.square(a[l], out=b['a2'])
+            np.dot(a2[l], self._wb[l], out=b['zb'])
+            b['zb'] += self._bb[l]
+            z = np.multiply(zr[l], zg[l], out=b['z'])
+            z += b['zb']
+            a[l + 1] = self._act_fn[l](z)
 
         # backward
         da = 0
         for l in range(self.L - 1, -1, -1):
-            if self.activation_func[l] == self.softmax:  # softmax with loss
+            code = self._act_code[l]
+            if code == 2:    # softmax with loss
                 dz = a[l + 1] - label
-            elif self.activation_func[l] == self.relu:  # relu
+            elif code == 0:  # relu
                 dz = da * (a[l + 1] != 0)
-            else:  # sigmoid
+            else:            # sigmoid
                 dz = da * (1.0 - a[l + 1]) * a[l + 1]
 
-            dzr = dz * zg[l]
-            dzg = dz * zr[l]
+            dzr, dzg = np.split(buf[l]['dz_rg'], 2, axis=1)
+            np.multiply(dz, zg[l], out=dzr)
+            np.multiply(dz, zr[l], out=dzg)
             dzb = dz
 
-            grad['br' + str(l)] = np.sum(dzr, axis=0)
-            grad['bg' + str(l)] = np.sum(dzg, axis=0)
-            grad['bb' + str(l)] = np.sum(dzb, axis=0)
-
-            grad['wr' + str(l)] = np.dot(a[l].T, dzr)
-            grad['wg' + str(l)] = np.dot(a[l].T, dzg)
-            grad['wb' + str(l)] = np.dot(np.square(a[l].T), dzb)
-
-            dar = np.dot(dzr, self.para['wr' + str(l)].T)
-            dag = np.dot(dzg, self.para['wg' + str(l)].T)
-            dab = np.dot(dzb, self.para['wb' + str(l)].T) * a[l]
-
-            da = dar + dag + dab + dab
+            gbr, gbg, gbb = self._gb[l]
+            gbr[...] = np.sum(dzr, axis=0)
+            gbg[...] = np.sum(dzg, axis=0)
+            gbb[...] = np.sum(dzb, axis=0)
+
+            aT = a[l].T  # shared by the r and g weight gradients
+            gwr, gwg, gwb = self._gw[l]
+            gwr[...] = np.dot(aT, dzr)
+            gwg[...] = np.dot(aT, dzg)
+            gwb[...] = np.dot(a2[l].T, dzb)  # a2 from forward
+
+            # "dz_rg" already holds [dzr | dzg] and "_w_rg_T" the matching
+            # packed transpose, so dar + dag collapse into one GEMM
+            da = np.dot(buf[l]['dz_rg'], self._w_rg_T[l])
+            dab = np.dot(dzb, self._wbT[l])
+            dab *= a[l]
+            # factor 2 from d(a^2 w)/da = 2 a w, written as two adds so no
+            # "2 * dab" temporary is built
+            da += dab
+            da += dab
 
         return grad
 
     def gradient(self, point, label):
+        # match the float32 parameters and buffers
+        point = point.astype(np.float32, copy=False)
+        label = label.astype(np.float32, copy=False)
         if self.NN_type == "CNN": return self._gradient_CNN(point, label)
         if self.NN_type == "QNN": return self._gradient_QNN(point, label)
 
+    def _load_grad(self, grad):
+        """
+        The optimizers below update the whole flat parameter vector in one
+        pass. Gradients from "gradient" already live in the flat buffer;
+        a caller passing its own dictionary gets copied in first.
+        """
+        if grad is self.grad: return
+        for key in grad:
+            self.grad[key][...] = np.reshape(grad[key], self.grad[key].shape)
+
     def _SGD(self, grad):
         """
         "Stochastic Gradient Descent"
@@ -265,8 +497,12 @@ class NN:
 
         :param grad: dictionary
         """
-        for key in grad.keys():
-            self.para[key] -= self.opt_para["lr"] * grad[key]
+        self._load_grad(grad)
+        s = self._scratch_flat
+
+        # para -= lr * g
+        np.multiply(self._grad_flat, self.opt_para["lr"], out=s)
+        self._para_flat -= s
 
     def _AdaGrad(self, grad):
         """
@@ -282,10 +518,19 @@ class NN:
         :param grad:dictionary
         """
         delta = 1e-7  # avoid divide zero
-        for key in grad.keys():
-            self.h[key] += np.square(grad[key])
-            self.para[key] -= self.opt_para["lr"] * grad[key] / \
-                              (np.sqrt(self.h[key]) + delta)
+        self._load_grad(grad)
+        g, h, s = self._grad_flat, self._h_flat, self._scratch_flat
+
+        # h += g * g
+        np.multiply(g, g, out=s)
+        h += s
+
+        # para -= lr * g / (sqrt(h) + delta)
+        np.sqrt(h, out=s)
+        s += delta
+        np.divide(g, s, out=s)
+        s *= self.opt_para["lr"]
+        self._para_flat -= s
 
     def _RMSprop(self, grad):
         """
@@ -306,12 +551,21 @@ class NN:
         :param grad: dictionary
         """
         delta = 1e-7  # avoid divide zero
-        for key in grad.keys():
-            self.h[key] *= self.opt_para["decay_rate"]
-            self.h[key] += (1.0 - self.opt_para["decay_rate"]) * \
-                           np.square(grad[key])
-            self.para[key] -= self.opt_para["lr"] * grad[key] / \
-                              (np.sqrt(self.h[key]) + delta)
+        self._load_grad(grad)
+        g, h, s = self._grad_flat, self._h_flat, self._scratch_flat
+
+        # h = decay_rate * h + (1 - decay_rate) * g * g
+        h *= self.opt_para["decay_rate"]
+        np.multiply(g, g, out=s)
+        s *= 1.0 - self.opt_para["decay_rate"]
+        h += s
+
+        # para -= lr * g / (sqrt(h) + delta)
+        np.sqrt(h, out=s)
+        s += delta
+        np.divide(g, s, out=s)
+        s *= self.opt_para["lr"]
+        self._para_flat -= s
 
     def _Adam(self, grad):
         """
@@ -327,12 +581,27 @@ class NN:
                np.sqrt(1.0 - self.opt_para["beta2"] ** self.opt_para["iter"]) / \
                (1.0 - self.opt_para["beta1"] ** self.opt_para["iter"])
         delta = 1e-7  # avoid divide zero
-        for key in grad.keys():
-            self.m[key] += (1.0 - self.opt_para["beta1"]) * \
-                           (grad[key] - self.m[key])
-            self.v[key] += (1.0 - self.opt_para["beta2"]) * \
-                           (grad[key] ** 2 - self.v[key])
-            self.para[key] -= lr_t * self.m[key] / (np.sqrt(self.v[key]) + delta)
+        self._load_grad(grad)
+        g, m, v = self._grad_flat, self._m_flat, self._v_flat
+        s = self._scratch_flat
+
+        # m += (1 - beta1) * (g - m)
+        np.subtract(g, m, out=s)
+        s *= 1.0 - self.opt_para["beta1"]
+        m += s
+
+        # v += (1 - beta2) * (g * g - v)
+        np.multiply(g, g, out=s)
+        s -= v
+        s *= 1.0 - self.opt_para["beta2"]
+        v += s
+
+        # para -= lr_t * m / (sqrt(v) + delta)
+        np.sqrt(v, out=s)
+        s += delta
+        np.divide(m, s, out=s)
+        s *= lr_t
+        self._para_flat -= s
 
     def optimizer(self, optimizer, grad):
         if optimizer == "Adam":
@@ -343,6 +612,7 @@ class NN:
             self._AdaGrad(grad)
         else:
             self._SGD(grad)
+        self._refresh_para_T()
 
     def train(self, train_point, train_label,
               valid_point=None, valid_label=None,
@@ -367,18 +637,26 @@ class NN:
         """
         if opt_para is not None: self.opt_para = opt_para
 
+        # match the float32 parameters so no pass upcasts back to float64
+        train_point = train_point.astype(np.float32, copy=False)
+        train_label = train_label.astype(np.float32, copy=False)
+        if valid_label is not None:
+            valid_point = valid_point.astype(np.float32, copy=False)
+            valid_label = valid_label.astype(np.float32, copy=False)
+
         stop_track = 0
         loss_max = 1000
         for _ in range(epoch):
-            begin = time.time()
+            # perf_counter is monotonic and higher resolution than time.time,
+            # so short steps are not lost to clock granularity or NTP jumps
+            begin = time.perf_counter()
 
             # train
             for _ in range(step_size):
                 self.optimizer(optimizer,
                                self.gradient(train_point, train_label))
 
-            end = time.time()
-            self.train_time += end - begin
+            self.train_time += time.perf_counter() - begin
 
             # early stopping
             if valid_label is None: continue
@@ -392,64 +670,82 @@ class NN:
 
     """ Estimator """
 
-    def _predict_CNN(self, point):
-        a = point  # [ N * K ], np.array
-        for l in range(self.L):
-            z = np.dot(a, self.para['w' + str(l)]) + self.para['b' + str(l)]
-            a = self.activation_func[l](z)
-        return a  # [ N * K ], np.array
+    def _logit_CNN(self, point):
+        a = point  # [ N * D ], np.array
+        for l in range(self.L - 1):
+            z = np.dot(a, self._w[l]) + self._b[l]
+            a = self._act_fn[l](z)
+        return np.dot(a, self._w[self.L - 1]) + \
+            self._b[self.L - 1]  # [ N * K ], np.array
 
-    def _predict_QNN(self, point):
-        a = point  # [ N * K ], np.array
+    def _logit_QNN(self, point):
+        a = point  # [ N * D ], np.array
         for l in range(self.L):
-            zr = np.dot(a, self.para['wr' + str(l)]) + self.para['br' + str(l)]
-            zg = np.dot(a, self.para['wg' + str(l)]) + self.para['bg' + str(l)]
-            zb = np.dot(a ** 2, self.para['wb' + str(l)]) + self.para['bb' + str(l)]
+            # one GEMM covers the r and g branches, see "initialize"
+            z_rg = np.dot(a, self._w_rg[l]) + self._b_rg[l]
+            zr, zg = np.split(z_rg, 2, axis=1)
+            zb = np.dot(a ** 2, self._wb[l]) + self._bb[l]
             z = np.multiply(zr, zg) + zb
-            a = self.activation_func[l](z)
-        return a  # [ N * K ], np.array
+            if l == self.L - 1: return z  # [ N * K ], np.array
+            a = self._act_fn[l](z)
+
+    def logit(self, point):
+        """
+        Forward pass up to the last layer's pre-activation "z".
+        """
+        if self.NN_type == "CNN": return self._logit_CNN(point)
+        if self.NN_type == "QNN": return self._logit_QNN(point)
 
     def predict(self, point):
-        if self.NN_type == "CNN": return self._predict_CNN(point)
-        if self.NN_type == "QNN": return self._predict_QNN(point)
+        return self._act_fn[self.L - 1](self.logit(point))
 
-    def CRE(self, point, label):
+    def CRE(self, point, label, y=None):
         """
         Return the cross entropy error (CRE).
-        """
-        # 1. check the input data
-        if len(point[0]) != self.D or len(label[0]) != self.K: return 0
 
-        # 2. compute the loss
-        y = self.predict(point)  # predict label
+        :param y: optional precomputed "predict(point)"; pass it when several
+            metrics are measured on the same set so the forward pass, the most
+            expensive part of each metric, runs only once
+        """
+        if y is None and self._act_code[self.L - 1] == 2:  # softmax output
+            # softmax + log fused as log-sum-exp: log(softmax(z)) is just
+            # z - max - log(sum(exp(z - max))), exact without the 1e-10 guard.
+            # The labels are one-hot, so instead of multiplying the full
+            # [ N * K ] log-probability matrix by a mostly-zero matrix, gather
+            # the one target logit per sample and average
+            z = self.logit(point)
+            z -= np.max(z, axis=1, keepdims=True)
+            lse = np.log(np.sum(np.exp(z), axis=1))
+            cls = np.argmax(label, axis=1)
+            return np.mean(lse - z[np.arange(z.shape[0]), cls])
+        if y is None: y = self.predict(point)  # predict label
         t = label  # actual label
         return -(np.sum(np.multiply(t, np.log(y + 1e-10))) / point.shape[0])
 
-    def test(self, point, label):
+    def test(self, point, label, y=None):
         """
         Return the accuracy, precision, and recall
+
+        :param y: optional precomputed "predict(point)", see "CRE"
         """
-        t = np.argmax(label, axis=1)                # actual label
-        y = np.argmax(self.predict(point), axis=1)  # predict label
-
-        accuracy = np.sum(y == t) / len(label)
-        precision = []
-        recall = []
-        for k in range(self.K):     # find the precision of each cluster
-            TP = 0  # Predict class == k, Actual class == k
-            FP = 0  # Predict class == k, Actual class != k
-            TN = 0  # Predict class != k, Actual class != k
-            FN = 0  # Predict class != k, Actual class == k
-            for n in range(len(point)):
-                if y[n] == k and t[n] == k: TP += 1
-                if y[n] == k and t[n] != k: FP += 1
-                if y[n] != k and t[n] != k: TN += 1
-                if y[n] != k and t[n] == k: FN += 1
-
-            if TP + FP == 0: precision.append(0)  # avoid divide zero
-            else: precision.append(TP / (TP + FP))
-
-            if TP + FN == 0: recall.append(0)  # avoid divide zero
-            else: recall.append(TP / (TP + FN))
-
-        return [accuracy, precision, recall]
+        if y is None: y = self.predict(point)
+        t = np.argmax(label, axis=1)    # actual label
+        y = np.argmax(y, axis=1)        # predict label
+
+        accuracy = np.count_nonzero(y == t) / y.size
+
+        # count every (actual, predict) pair at once instead of scanning the
+        # sample N*K times in Python
+        cm = np.zeros((self.K, self.K), dtype=np.int64)  # confusion matrix
+        np.add.at(cm, (t, y), 1)
+        TP = np.diag(cm)            # Predict class == k, Actual class == k
+        FP = cm.sum(axis=0) - TP    # Predict class == k, Actual class != k
+        FN = cm.sum(axis=1) - TP    # Predict class != k, Actual class == k
+
+        # "where" avoids divide zero, leaving 0 for empty classes
+        precision = np.divide(TP, TP + FP,
+                              out=np.zeros(self.K), where=(TP + FP) != 0)
+        recall = np.divide(TP, TP + FN,
+                           out=np.zeros(self.K), where=(TP + FN) != 0)
+
+        return [accuracy, list(precision), list(recall)]